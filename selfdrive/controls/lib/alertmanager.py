@@ -56,9 +56,12 @@ class AlertManager:
       if v.alert.event_type in clear_event_types:
         v.end_frame = -1
 
+      # most entries are expired, skip them before comparing
+      if not v.active(frame):
+        continue
+
       # sort by priority first and then by start_frame
-      greater = current_alert.alert is None or (v.alert.priority, v.start_frame) > (current_alert.alert.priority, current_alert.start_frame)
-      if v.active(frame) and greater:
+      if current_alert.alert is None or (v.alert.priority, v.start_frame) > (current_alert.alert.priority, current_alert.start_frame):
         current_alert = v
 
     return current_alert.alert
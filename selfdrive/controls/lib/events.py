@@ -1,8 +1,11 @@
+import copy
 import os
+import sys
+from collections import defaultdict
 from enum import IntEnum
-from typing import Dict, Union, Callable, List, Optional
-
-import linecache
+from functools import reduce
+from operator import or_
+from typing import DefaultDict, Dict, Union, Callable, List, Optional, Tuple
 
 from cereal import log, car
 import cereal.messaging as messaging
@@ -10,7 +13,7 @@ from common.realtime import DT_CTRL
 from common.conversions import Conversions as CV
 from selfdrive.locationd.calibrationd import MIN_SPEED_FILTER
 
-from common.params import Params
+from common.params import Params, UnknownKeyName
 
 AlertSize = log.ControlsState.AlertSize
 AlertStatus = log.ControlsState.AlertStatus
@@ -29,36 +32,56 @@ class Priority(IntEnum):
   HIGHEST = 5
 
 
-# Event types
+# Event types, interned so dict lookups keyed on them hit the identity fast path
 class ET:
-  ENABLE = 'enable'
-  PRE_ENABLE = 'preEnable'
-  NO_ENTRY = 'noEntry'
-  WARNING = 'warning'
-  USER_DISABLE = 'userDisable'
-  SOFT_DISABLE = 'softDisable'
-  IMMEDIATE_DISABLE = 'immediateDisable'
-  PERMANENT = 'permanent'
+  ENABLE = sys.intern('enable')
+  PRE_ENABLE = sys.intern('preEnable')
+  NO_ENTRY = sys.intern('noEntry')
+  WARNING = sys.intern('warning')
+  USER_DISABLE = sys.intern('userDisable')
+  SOFT_DISABLE = sys.intern('softDisable')
+  IMMEDIATE_DISABLE = sys.intern('immediateDisable')
+  PERMANENT = sys.intern('permanent')
+
 
+# soft disable alerts escalate to immediate disable in the last half second
+SOFT_DISABLE_IMMEDIATE_TICKS = int(0.5 / DT_CTRL)
+
+# alert duration in seconds -> controls frames, alerts share a handful of durations
+DURATION_TICKS: Dict[float, int] = {}
 
 # get event name from enum
 EVENT_NAME = {v: k for k, v in EventName.schema.enumerants.items()}
 
+LANG_DIR = '/data/openpilot/selfdrive/assets/addon/lang/events/'
 try:
-  LANG_FILE='/data/openpilot/selfdrive/assets/addon/lang/events/' + Params().get("LanguageSetting", encoding="utf8") + '.txt'
-except:
-  LANG_FILE='/data/openpilot/selfdrive/assets/addon/lang/events/main_en.txt'
-  pass
+  LANG_SETTING = Params().get("LanguageSetting", encoding="utf8")
+except UnknownKeyName:
+  LANG_SETTING = None
+LANG_FILE = LANG_DIR + (LANG_SETTING or 'main_en') + '.txt'
+if not os.path.isfile(LANG_FILE):
+  LANG_FILE = LANG_DIR + 'main_en.txt'
 
 # opkr
-def tr(line_num: int):
-  return linecache.getline(LANG_FILE, line_num)
+# load the language file once, 1-based like linecache. Lines are interned so
+# repeated texts are one object and text changes can be checked by identity.
+# Missing line numbers read as '', so tr can be the dict's own __getitem__
+LANG_LINES: DefaultDict[int, str] = defaultdict(str)
+try:
+  with open(LANG_FILE, 'r', encoding='utf-8') as f:
+    LANG_LINES.update(enumerate((sys.intern(line) for line in f), 1))
+except OSError:
+  pass
+
+tr: Callable[[int], str] = LANG_LINES.__getitem__
 
 class Events:
   def __init__(self):
+    # kept as plain lists: controlsd compares and copies names, car interfaces remove from events
     self.events: List[int] = []
     self.static_events: List[int] = []
-    self.events_prev = dict.fromkeys(EVENTS.keys(), 0)
+    # consecutive ticks each event has been active, absent means 0. Sparse so clear() is O(active events)
+    self.events_prev: Dict[int, int] = {}
 
   @property
   def names(self) -> List[int]:
@@ -73,47 +96,62 @@ class Events:
     self.events.append(event_name)
 
   def clear(self) -> None:
-    self.events_prev = {k: (v + 1 if k in self.events else 0) for k, v in self.events_prev.items()}
+    # update the counters in place rather than building a new dict every tick
+    events_prev = self.events_prev
+    active = set(self.events)
+    for k in [k for k in events_prev if k not in active]:
+      del events_prev[k]
+    for k in active:
+      events_prev[k] = events_prev.get(k, 0) + 1
     self.events = self.static_events.copy()
 
   def any(self, event_type: str) -> bool:
-    return any(event_type in EVENTS.get(e, {}) for e in self.events)
+    bit = ET_BIT[event_type]
+    masks = EVENT_MASK
+    return any(masks[e] & bit for e in self.events)
 
   def create_alerts(self, event_types: List[str], callback_args=None):
     if callback_args is None:
       callback_args = []
 
     ret = []
+    events_prev = self.events_prev
+    type_offsets = [(et, ET_INDEX[et]) for et in event_types]
     for e in self.events:
-      types = EVENTS[e].keys()
-      for et in event_types:
-        if et in types:
-          alert = EVENTS[e][et]
-          if not isinstance(alert, Alert):
-            alert = alert(*callback_args)
-
-          if DT_CTRL * (self.events_prev[e] + 1) >= alert.creation_delay:
-            alert.alert_type = f"{EVENT_NAME[e]}/{et}"
-            alert.event_type = et
-            ret.append(alert)
+      base = e * NUM_ET
+      active_time = DT_CTRL * (events_prev.get(e, 0) + 1)
+      for et, i in type_offsets:
+        alert = ALERTS[base + i]
+        if alert is None:
+          continue
+        if not isinstance(alert, Alert):
+          alert = alert(*callback_args)
+          alert.alert_type = ALERT_TYPES[base + i]
+          alert.event_type = et
+
+        if active_time >= alert.creation_delay:
+          ret.append(alert)
     return ret
 
   def add_from_msg(self, events):
-    for e in events:
-      self.events.append(e.name.raw)
+    self.events.extend(e.name.raw for e in events)
 
   def to_msg(self):
     ret = []
+    new_message = car.CarEvent.new_message
     for event_name in self.events:
-      event = car.CarEvent.new_message()
+      event = new_message()
       event.name = event_name
-      for event_type in EVENTS.get(event_name, {}):
+      for event_type in EVENT_TYPES[event_name]:
         setattr(event, event_type, True)
       ret.append(event)
     return ret
 
 
 class Alert:
+  __slots__ = ('alert_text_1', 'alert_text_2', 'alert_status', 'alert_size', 'priority', 'visual_alert',
+               'audible_alert', 'duration', 'alert_rate', 'creation_delay', 'alert_type', 'event_type')
+
   def __init__(self,
                alert_text_1: str,
                alert_text_2: str,
@@ -134,7 +172,10 @@ class Alert:
     self.visual_alert = visual_alert
     self.audible_alert = audible_alert
 
-    self.duration = int(duration / DT_CTRL)
+    duration_ticks = DURATION_TICKS.get(duration)
+    if duration_ticks is None:
+      duration_ticks = DURATION_TICKS[duration] = int(duration / DT_CTRL)
+    self.duration = duration_ticks
 
     self.alert_rate = alert_rate
     self.creation_delay = creation_delay
@@ -145,67 +186,72 @@ class Alert:
   def __str__(self) -> str:
     return f"{self.alert_text_1}/{self.alert_text_2} {self.priority} {self.visual_alert} {self.audible_alert}"
 
-  def __gt__(self, alert2) -> bool:
-    return self.priority > alert2.priority
 
+# ********** alert factories **********
+# plain functions rather than Alert subclasses, they only fix constructor arguments
 
-class NoEntryAlert(Alert):
-  def __init__(self, alert_text_2: str, visual_alert: car.CarControl.HUDControl.VisualAlert=VisualAlert.none):
-    super().__init__(tr(1), alert_text_2, AlertStatus.normal,
-                     AlertSize.mid, Priority.LOW, visual_alert,
-                     AudibleAlert.refuse, 3.)
+def NoEntryAlert(alert_text_2: str, visual_alert: car.CarControl.HUDControl.VisualAlert=VisualAlert.none) -> Alert:
+  return Alert(tr(1), alert_text_2, AlertStatus.normal,
+               AlertSize.mid, Priority.LOW, visual_alert,
+               AudibleAlert.refuse, 3.)
 
 
-class SoftDisableAlert(Alert):
-  def __init__(self, alert_text_2: str):
-    super().__init__(tr(2), alert_text_2,
-                     AlertStatus.userPrompt, AlertSize.full,
-                     Priority.MID, VisualAlert.steerRequired,
-                     AudibleAlert.warningSoft, 2.),
+def SoftDisableAlert(alert_text_2: str) -> Alert:
+  return Alert(tr(2), alert_text_2,
+               AlertStatus.userPrompt, AlertSize.full,
+               Priority.MID, VisualAlert.steerRequired,
+               AudibleAlert.warningSoft, 2.)
 
 
 # less harsh version of SoftDisable, where the condition is user-triggered
-class UserSoftDisableAlert(SoftDisableAlert):
-  def __init__(self, alert_text_2: str):
-    super().__init__(alert_text_2),
-    self.alert_text_1 = tr(3)
+def UserSoftDisableAlert(alert_text_2: str) -> Alert:
+  return Alert(tr(3), alert_text_2,
+               AlertStatus.userPrompt, AlertSize.full,
+               Priority.MID, VisualAlert.steerRequired,
+               AudibleAlert.warningSoft, 2.)
 
 
-class ImmediateDisableAlert(Alert):
-  def __init__(self, alert_text_2: str):
-    super().__init__(tr(4), alert_text_2,
-                     AlertStatus.critical, AlertSize.full,
-                     Priority.HIGHEST, VisualAlert.steerRequired,
-                     AudibleAlert.warningImmediate, 4.),
+def ImmediateDisableAlert(alert_text_2: str) -> Alert:
+  return Alert(tr(4), alert_text_2,
+               AlertStatus.critical, AlertSize.full,
+               Priority.HIGHEST, VisualAlert.steerRequired,
+               AudibleAlert.warningImmediate, 4.)
 
 
-class EngagementAlert(Alert):
-  def __init__(self, audible_alert: car.CarControl.HUDControl.AudibleAlert):
-    super().__init__("", "",
-                     AlertStatus.normal, AlertSize.none,
-                     Priority.MID, VisualAlert.none,
-                     audible_alert, .2),
+def EngagementAlert(audible_alert: car.CarControl.HUDControl.AudibleAlert) -> Alert:
+  return Alert("", "",
+               AlertStatus.normal, AlertSize.none,
+               Priority.MID, VisualAlert.none,
+               audible_alert, .2)
 
 
-class NormalPermanentAlert(Alert):
-  def __init__(self, alert_text_1: str, alert_text_2: str = "", duration: float = 0.2, priority: Priority = Priority.LOWER, creation_delay: float = 0.):
-    super().__init__(alert_text_1, alert_text_2,
-                     AlertStatus.normal, AlertSize.mid if len(alert_text_2) else AlertSize.small,
-                     priority, VisualAlert.none, AudibleAlert.none, duration, creation_delay=creation_delay),
+def NormalPermanentAlert(alert_text_1: str, alert_text_2: str = "", duration: float = 0.2, priority: Priority = Priority.LOWER, creation_delay: float = 0.) -> Alert:
+  return Alert(alert_text_1, alert_text_2,
+               AlertStatus.normal, AlertSize.mid if len(alert_text_2) else AlertSize.small,
+               priority, VisualAlert.none, AudibleAlert.none, duration, creation_delay=creation_delay)
 
 
-class StartupAlert(Alert):
-  def __init__(self, alert_text_1: str, alert_text_2: str = tr(5), alert_status=AlertStatus.normal):
-    super().__init__(alert_text_1, alert_text_2,
-                     alert_status, AlertSize.mid,
-                     Priority.LOWER, VisualAlert.none, AudibleAlert.none, 10.),
+def StartupAlert(alert_text_1: str, alert_text_2: str = tr(5), alert_status=AlertStatus.normal) -> Alert:
+  return Alert(alert_text_1, alert_text_2,
+               alert_status, AlertSize.mid,
+               Priority.LOWER, VisualAlert.none, AudibleAlert.none, 10.)
 
 
 # ********** helper functions **********
+def with_alert_type(alert: Alert, alert_type: str, event_type: str) -> Alert:
+  # static alerts are built once per entry, so only copy one already stamped for another entry
+  if alert.event_type is not None:
+    alert = copy.copy(alert)
+  alert.alert_type = alert_type
+  alert.event_type = event_type
+  return alert
+
+# (factor, unit) indexed by the metric flag
+SPEED_UNITS = ((CV.MS_TO_MPH, 'mph'), (CV.MS_TO_KPH, 'km/h'))
+
 def get_display_speed(speed_ms: float, metric: bool) -> str:
-  speed = int(round(speed_ms * (CV.MS_TO_KPH if metric else CV.MS_TO_MPH)))
-  unit = 'km/h' if metric else 'mph'
-  return f"{speed} {unit}"
+  factor, unit = SPEED_UNITS[metric]
+  return f"{int(round(speed_ms * factor))} {unit}"
 
 
 # ********** alert callback functions **********
@@ -213,19 +259,24 @@ def get_display_speed(speed_ms: float, metric: bool) -> str:
 AlertCallbackType = Callable[[car.CarParams, messaging.SubMaster, bool, int], Alert]
 
 
+class SoftDisableCallback:
+  __slots__ = ('alert_text_2', 'soft_alert')
+
+  def __init__(self, alert_text_2: str, soft_alert: Callable[[str], Alert]):
+    self.alert_text_2 = alert_text_2
+    self.soft_alert = soft_alert
+
+  def __call__(self, CP: car.CarParams, sm: messaging.SubMaster, metric: bool, soft_disable_time: int) -> Alert:
+    if soft_disable_time < SOFT_DISABLE_IMMEDIATE_TICKS:
+      return ImmediateDisableAlert(self.alert_text_2)
+    return self.soft_alert(self.alert_text_2)
+
+
 def soft_disable_alert(alert_text_2: str) -> AlertCallbackType:
-  def func(CP: car.CarParams, sm: messaging.SubMaster, metric: bool, soft_disable_time: int) -> Alert:
-    if soft_disable_time < int(0.5 / DT_CTRL):
-      return ImmediateDisableAlert(alert_text_2)
-    return SoftDisableAlert(alert_text_2)
-  return func
+  return SoftDisableCallback(alert_text_2, SoftDisableAlert)
 
 def user_soft_disable_alert(alert_text_2: str) -> AlertCallbackType:
-  def func(CP: car.CarParams, sm: messaging.SubMaster, metric: bool, soft_disable_time: int) -> Alert:
-    if soft_disable_time < int(0.5 / DT_CTRL):
-      return ImmediateDisableAlert(alert_text_2)
-    return UserSoftDisableAlert(alert_text_2)
-  return func
+  return SoftDisableCallback(alert_text_2, UserSoftDisableAlert)
 
 
 def below_engage_speed_alert(CP: car.CarParams, sm: messaging.SubMaster, metric: bool, soft_disable_time: int) -> Alert:
@@ -271,34 +322,46 @@ def joystick_alert(CP: car.CarParams, sm: messaging.SubMaster, metric: bool, sof
   return NormalPermanentAlert("Joystick Mode", vals)
 
 # opkr
+# (mtime, address text, address value) per CAN error file, re-read only when the file changes
+CAN_ERROR_CACHE: Dict[str, Tuple[float, str, int]] = {}
+
+def read_can_error_file(path: str) -> Optional[Tuple[str, int]]:
+  try:
+    mtime = os.stat(path).st_mtime
+  except OSError:
+    return None
+
+  cached = CAN_ERROR_CACHE.get(path)
+  if cached is None or cached[0] != mtime:
+    with open(path, 'r') as f:
+      add = f.readline()
+    cached = CAN_ERROR_CACHE[path] = (mtime, add, int(add, 0))
+  return cached[1], cached[2]
+
+
 def can_error_alert(CP: car.CarParams, sm: messaging.SubMaster, metric: bool, soft_disable_time: int) -> Alert:
-  if os.path.isfile('/data/log/can_missing.txt'):
-    f = open('/data/log/can_missing.txt', 'r')
-    add = f.readline()
-    add_int = int(add, 0)
-    f.close()
-    return Alert(
-      "CAN Error: %s is missing\n Decimal Value : %d" % (add, add_int),
-      "",
-      AlertStatus.normal, AlertSize.small,
-      Priority.LOW, VisualAlert.none, AudibleAlert.none, .2, creation_delay=1.)
-  elif os.path.isfile('/data/log/can_timeout.txt'):
-    f = open('/data/log/can_timeout.txt', 'r')
-    add = f.readline()
-    add_int = int(add, 0)
-    f.close()
+  can_missing = read_can_error_file('/data/log/can_missing.txt')
+  if can_missing is not None:
     return Alert(
-      "CAN Error: %s is timeout\n Decimal Value : %d" % (add, add_int),
+      "CAN Error: %s is missing\n Decimal Value : %d" % can_missing,
       "",
       AlertStatus.normal, AlertSize.small,
       Priority.LOW, VisualAlert.none, AudibleAlert.none, .2, creation_delay=1.)
-  else:
+
+  can_timeout = read_can_error_file('/data/log/can_timeout.txt')
+  if can_timeout is not None:
     return Alert(
-      "CAN Error: Check Harness Connections",
+      "CAN Error: %s is timeout\n Decimal Value : %d" % can_timeout,
       "",
       AlertStatus.normal, AlertSize.small,
       Priority.LOW, VisualAlert.none, AudibleAlert.none, .2, creation_delay=1.)
 
+  return Alert(
+    "CAN Error: Check Harness Connections",
+    "",
+    AlertStatus.normal, AlertSize.small,
+    Priority.LOW, VisualAlert.none, AudibleAlert.none, .2, creation_delay=1.)
+
 
 EVENTS: Dict[int, Dict[str, Union[Alert, AlertCallbackType]]] = {
   # ********** events with no alerts **********
@@ -1091,3 +1154,41 @@ EVENTS: Dict[int, Dict[str, Union[Alert, AlertCallbackType]]] = {
   },
 
 }
+
+
+# event types in a fixed order, used to index the alert tables below
+ET_ORDER = (ET.ENABLE, ET.PRE_ENABLE, ET.NO_ENTRY, ET.WARNING,
+            ET.USER_DISABLE, ET.SOFT_DISABLE, ET.IMMEDIATE_DISABLE, ET.PERMANENT)
+ET_INDEX = {et: i for i, et in enumerate(ET_ORDER)}
+NUM_ET = len(ET_ORDER)
+NUM_EVENTS = max(EVENT_NAME) + 1
+
+# the per-event tables below are indexed directly by event id
+
+# bitmask of the event types defined for each event, used by Events.any
+ET_BIT = {et: 1 << i for i, et in enumerate(ET_ORDER)}
+EVENT_MASK: Tuple[int, ...] = tuple(reduce(or_, (ET_BIT[et] for et in EVENTS.get(e, {})), 0) for e in range(NUM_EVENTS))
+
+# event types defined for each event, used by Events.to_msg
+EVENT_TYPES: Tuple[Tuple[str, ...], ...] = tuple(tuple(EVENTS.get(e, {})) for e in range(NUM_EVENTS))
+
+# EVENTS flattened to one entry per (event id, event type), at index
+# event id * NUM_ET + ET_INDEX[event type], so create_alerts does no hashing.
+# ALERT_TYPES holds the matching "<event name>/<event type>" strings, only for
+# pairs that have an alert ('' elsewhere). Static alerts get alert_type and event_type set
+# here, so they are never mutated at runtime
+alert_types: List[str] = [''] * (NUM_EVENTS * NUM_ET)
+alert_table: List[Optional[Union[Alert, AlertCallbackType]]] = [None] * (NUM_EVENTS * NUM_ET)
+for e, alerts in EVENTS.items():
+  for et, alert in alerts.items():
+    i = e * NUM_ET + ET_INDEX[et]
+    alert_type = alert_types[i] = sys.intern(f"{EVENT_NAME[e]}/{et}")
+    if isinstance(alert, Alert):
+      alert = alerts[et] = with_alert_type(alert, alert_type, et)
+    alert_table[i] = alert
+ALERT_TYPES: Tuple[str, ...] = tuple(alert_types)
+ALERTS = tuple(alert_table)
+del alert_types, alert_table
+
+def get_alert(event_name: int, event_type: str) -> Optional[Union[Alert, AlertCallbackType]]:
+  return ALERTS[event_name * NUM_ET + ET_INDEX[event_type]]